@@ -0,0 +1,479 @@
+import os
+import re
+import time
+import asyncio
+import logging
+import httpx
+import orjson
+from contextlib import aclosing
+from datetime import datetime
+from hashlib import blake2b
+from typing import AsyncIterator, Protocol
+from cachetools import LRUCache
+from openai import AsyncOpenAI
+from storage import INPUT_LOG_PATH, OUTPUT_LOG_PATH, JsonlBatchWriter, log_version, read_jsonl_cached, read_last_jsonl_cached
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import (
+    ApplicationBuilder,
+    CommandHandler,
+    MessageHandler,
+    CallbackQueryHandler,
+    ContextTypes,
+    filters,
+)
+from telegram.error import BadRequest
+
+# Shared by the OpenRouter (rag.py) and Ollama (telegram.py) bots
+logger = logging.getLogger("TelegramTrafficBot")
+
+# ================= CONFIG =================
+INPUT_DATA_PATH = INPUT_LOG_PATH
+OUTPUT_DATA_PATH = OUTPUT_LOG_PATH
+# Chat turns are buffered and appended in batches by a background task
+CHAT_LOG = JsonlBatchWriter("data/chat_log.jsonl")
+
+
+# ================= LOAD CONTEXT (RAG) =================
+# Compact JSON per log, rebuilt only when that file changes on disk
+_rendered_logs = {}
+
+def render_log(path, select):
+    version = log_version(path)
+    cached = _rendered_logs.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    text = orjson.dumps(select(read_jsonl_cached(path))).decode()
+    _rendered_logs[path] = (version, text)
+    return text
+
+
+def newest_per_venue(records):
+    # A re-analysis supersedes older entries for the same venue; every venue stays in context
+    latest = {}
+    for record in records:
+        venue = record.get("venue")
+        name = venue.get("name") if isinstance(venue, dict) else None
+        key = str(name).strip().lower() if name else len(latest)
+        latest.pop(key, None)
+        latest[key] = record
+    return list(latest.values())
+
+
+def newest_only(records):
+    # Decisions describe the latest input state, as in the button panels
+    return records[-1:]
+
+
+def render_section(title, path, select):
+    if not os.path.exists(path):
+        return ""
+    try:
+        section = f"{title}:\n" + render_log(path, select) + "\n\n"
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s loaded successfully. Entries: %d", os.path.basename(path), len(read_jsonl_cached(path)))
+        return section
+    except Exception as e:
+        logger.error("❌ Error reading %s: %s", os.path.basename(path), e)
+        return ""
+
+
+async def load_context():
+    logger.info("📚 Loading RAG context from JSON files...")
+    # Both logs are read and rendered in parallel worker threads
+    input_section, output_section = await asyncio.gather(
+        asyncio.to_thread(render_section, "INPUT TRAFFIC STATE DATA", INPUT_DATA_PATH, newest_per_venue),
+        asyncio.to_thread(render_section, "AI TRAFFIC DECISION DATA", OUTPUT_DATA_PATH, newest_only),
+    )
+    context_str = input_section + output_section
+    logger.info("✅ RAG context loaded. Size: %d bytes.", len(context_str))
+    return context_str
+
+
+# ================= LLM BACKENDS =================
+class LLMBackend(Protocol):
+    model: str
+
+    def stream(self, system_prompt: str, prompt: str) -> AsyncIterator[str]: ...
+
+    async def aclose(self): ...
+
+
+class OpenRouterBackend:
+    def __init__(self, model):
+        self.model = model
+        self.client = AsyncOpenAI(
+            base_url="https://openrouter.ai/api/v1",
+            api_key=os.getenv("OPENROUTER_API_KEY"),
+        )
+
+    async def stream(self, system_prompt, prompt):
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            stream=True,
+            timeout=60
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+    async def aclose(self):
+        await self.client.close()
+
+
+class OllamaBackend:
+    def __init__(self, model, base_url="http://localhost:11434"):
+        self.model = model
+        # Pooled client keeps the connection to the local Ollama server alive between queries
+        self.http = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=120,
+            headers={"User-Agent": "SmartVenueTrafficAI/1.0"},
+        )
+
+    async def stream(self, system_prompt, prompt):
+        payload = {
+            "model": self.model,
+            "prompt": f"{system_prompt}\n\nUSER QUERY: {prompt}\n\nRESPONSE:",
+            "stream": True
+        }
+        async with self.http.stream("POST", "/api/generate", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                part = orjson.loads(line)
+                if part.get("response"):
+                    yield part["response"]
+                if part.get("done"):
+                    break
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+# ================= LLM QUERY =================
+# Progressive edits stay under Telegram's ~1 edit/s flood limit
+EDIT_INTERVAL_SEC = 0.8
+EDIT_MIN_CHARS = 24
+NEED_ANALYSIS_TAG = "[NEED_ANALYSIS:"
+NEED_ANALYSIS_RE = re.compile(r"\[NEED_ANALYSIS:\s*([^\]]+)\]")
+
+# Answers keyed by (model, prompt, context) digests; any change to the data yields a new key
+answer_cache = LRUCache(maxsize=256)
+
+
+def digest(text):
+    return blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+async def edit_progress(message, text, reply_markup=None):
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        if "Message is not modified" not in str(e):
+            raise
+
+
+async def query_llm(llm: LLMBackend, preamble, prompt, context, message=None):
+    key = (llm.model, digest(prompt), digest(context))
+    cached = answer_cache.get(key)
+    if cached:
+        logger.info("⚡ Answer served from cache.")
+        return cached
+    logger.info("🤖 Querying %s (Model: %s)...", type(llm).__name__, llm.model)
+    system_prompt = preamble + context + "\n"
+
+    try:
+        result, shown, last_edit = "", 0, 0.0
+        async with aclosing(llm.stream(system_prompt, prompt)) as deltas:
+            async for delta in deltas:
+                result += delta
+                # The analysis trigger is never shown; stop generating as soon as it is complete
+                if NEED_ANALYSIS_TAG in result:
+                    if NEED_ANALYSIS_RE.search(result):
+                        break
+                    continue
+                now = time.monotonic()
+                if message and len(result) - shown >= EDIT_MIN_CHARS and now - last_edit >= EDIT_INTERVAL_SEC:
+                    try:
+                        await edit_progress(message, result)
+                    except BadRequest:
+                        message = None  # stop live updates; the final text is still sent
+                    shown, last_edit = len(result), now
+        if not result:
+            return "No response available from AI engine."
+        logger.info("✅ AI query successful.")
+        answer_cache[key] = result
+        return result
+    except Exception as e:
+        logger.error("❌ %s query failed: %s", type(llm).__name__, e)
+        return f"System Error: Unable to contact AI engine.\nDetails: {str(e)}"
+
+
+# ================= DATA HELPERS =================
+# Panel text per renderer, re-rendered only when its log changes; the newest entry is tail-read from disk
+_panel_cache = {}
+
+def panel_text(path, render):
+    version = log_version(path)
+    cached = _panel_cache.get(render)
+    if cached and cached[0] == version:
+        return cached[1]
+    text = render(read_last_jsonl_cached(path) or {})
+    _panel_cache[render] = (version, text)
+    return text
+
+
+# ================= SAFE EDIT (FIXES MESSAGE NOT MODIFIED ERROR) =================
+async def safe_edit(query, text, reply_markup=None):
+    try:
+        await query.edit_message_text(
+            text=text,
+            reply_markup=reply_markup
+        )
+    except BadRequest as e:
+        # Ignore harmless Telegram error
+        if "Message is not modified" in str(e):
+            pass
+        else:
+            # Fallback: send new message if edit fails
+            await query.message.reply_text(text, reply_markup=reply_markup)
+
+
+# ================= PROFESSIONAL MENUS =================
+# Fixed keyboards, built once at import and reused for every reply
+MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Traffic Overview", callback_data="traffic")],
+    [InlineKeyboardButton("AI Decision Intelligence", callback_data="ai")],
+    [InlineKeyboardButton("System Status", callback_data="status")],
+    [InlineKeyboardButton("Ask AI (Custom Query)", callback_data="ask")]
+])
+
+TRAFFIC_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Current Traffic Severity", callback_data="severity")],
+    [InlineKeyboardButton("Weather Condition", callback_data="weather")],
+    [InlineKeyboardButton("Venue Monitoring Status", callback_data="venue")],
+    [InlineKeyboardButton("Back to Main Menu", callback_data="main")]
+])
+
+AI_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Priority Level", callback_data="priority")],
+    [InlineKeyboardButton("Actions Executed", callback_data="actions")],
+    [InlineKeyboardButton("Back to Main Menu", callback_data="main")]
+])
+
+
+# ================= START COMMAND =================
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    logger.info("👋 User %s (ID: %s) started the bot.", user.username, user.id)
+    text = (
+        "SMART TRAFFIC MANAGEMENT SYSTEM\n"
+        "City: Pune\n"
+        "Mode: AI Traffic Intelligence (RAG Enabled)\n\n"
+        "Select a module from the control panel below."
+    )
+    await update.message.reply_text(text, reply_markup=MAIN_MENU)
+
+
+# ================= BUTTON HANDLER =================
+MAIN_PANEL_TEXT = "Main Control Panel - Select Module:"
+TRAFFIC_PANEL_TEXT = "Traffic Overview Module"
+AI_PANEL_TEXT = "AI Decision Intelligence Module"
+ASK_PROMPT_TEXT = "AI Query Mode Activated.\nPlease enter your traffic-related question."
+STATUS_MSG = (
+    "SYSTEM STATUS\n"
+    "AI Engine: Connected (Ollama)\n"
+    "Data Pipeline: Active\n"
+    "Monitoring Network: Operational\n"
+    "City Grid: Pune Smart Traffic System"
+)
+
+
+def severity_text(entry):
+    severity = entry.get("traffic_prediction", {}).get("severity", "Not Available")
+    return f"Current Traffic Severity: {severity}"
+
+
+def weather_text(entry):
+    weather = entry.get("weather", {}).get("condition", "Not Available")
+    return f"Weather Condition: {weather}"
+
+
+def venue_text(entry):
+    venue = entry.get("venue", {}).get("name", "Not Available")
+    return f"Monitored Venue: {venue}"
+
+
+def priority_text(entry):
+    priority = entry.get("priority_level", "Not Available")
+    return f"AI Priority Level: {priority}"
+
+
+def actions_text(entry):
+    actions = entry.get("traffic_management_actions", [])
+    return f"Total AI Actions Executed: {len(actions)}"
+
+
+# One small handler per callback; logs are only read by the ones that display data
+async def show_main(query, context):
+    await safe_edit(query, MAIN_PANEL_TEXT, reply_markup=MAIN_MENU)
+
+
+async def show_traffic(query, context):
+    await safe_edit(query, TRAFFIC_PANEL_TEXT, reply_markup=TRAFFIC_MENU)
+
+
+async def show_ai(query, context):
+    await safe_edit(query, AI_PANEL_TEXT, reply_markup=AI_MENU)
+
+
+async def show_status(query, context):
+    await safe_edit(query, STATUS_MSG, reply_markup=MAIN_MENU)
+
+
+async def show_severity(query, context):
+    await safe_edit(query, panel_text(INPUT_DATA_PATH, severity_text), reply_markup=TRAFFIC_MENU)
+
+
+async def show_weather(query, context):
+    await safe_edit(query, panel_text(INPUT_DATA_PATH, weather_text), reply_markup=TRAFFIC_MENU)
+
+
+async def show_venue(query, context):
+    await safe_edit(query, panel_text(INPUT_DATA_PATH, venue_text), reply_markup=TRAFFIC_MENU)
+
+
+async def show_priority(query, context):
+    await safe_edit(query, panel_text(OUTPUT_DATA_PATH, priority_text), reply_markup=AI_MENU)
+
+
+async def show_actions(query, context):
+    await safe_edit(query, panel_text(OUTPUT_DATA_PATH, actions_text), reply_markup=AI_MENU)
+
+
+async def start_ask(query, context):
+    context.user_data["rag_mode"] = True
+    await safe_edit(query, ASK_PROMPT_TEXT)
+
+
+BUTTON_HANDLERS = {
+    "main": show_main,
+    "traffic": show_traffic,
+    "ai": show_ai,
+    "status": show_status,
+    "severity": show_severity,
+    "weather": show_weather,
+    "venue": show_venue,
+    "priority": show_priority,
+    "actions": show_actions,
+    "ask": start_ask,
+}
+
+
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer(cache_time=2)
+
+    handler = BUTTON_HANDLERS.get(query.data)
+    if handler:
+        await handler(query, context)
+
+
+# ================= RAG CHAT HANDLER =================
+async def finish_query(update: Update, context: ContextTypes.DEFAULT_TYPE, reply, user_text, ai_response, model):
+    try:
+        await edit_progress(reply, ai_response, reply_markup=MAIN_MENU)
+    except BadRequest:
+        await update.message.reply_text(ai_response, reply_markup=MAIN_MENU)
+    context.user_data["rag_mode"] = False
+
+    # Logging
+    try:
+        user = update.effective_user
+        log_entry = {
+            "timestamp": datetime.now().isoformat(),
+            "user_id": user.id,
+            "username": user.username,
+            "user_query": user_text,
+            "assistant_response": ai_response,
+            "model": model
+        }
+        CHAT_LOG.put(log_entry)
+        logger.debug("Chat interaction queued for chat_log.jsonl")
+    except Exception as e:
+        logger.error("❌ Chat logging error: %s", e)
+
+
+def message_handler(answer_query):
+    async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_text = update.message.text
+        user = update.effective_user
+
+        if context.user_data.get("rag_mode"):
+            # Messages within one chat stay ordered; other chats are not blocked
+            async with context.chat_data.setdefault("lock", asyncio.Lock()):
+                await answer_query(update, context, user_text, user)
+        else:
+            logger.debug("Interpreted regular message from %s: %.30s", user.username, user_text)
+            await update.message.reply_text(
+                "Please use the control panel below to interact with the system.",
+                reply_markup=MAIN_MENU
+            )
+    return handle_message
+
+
+# ================= MAIN (STABLE + CTRL+C SAFE) =================
+def run_bot(token, answer_query, llm: LLMBackend, on_shutdown=None):
+    logger.info("🚀 Launching Smart Traffic Professional Telegram Bot...")
+
+    if not token:
+        logger.critical("❌ TELEGRAM_BOT_TOKEN is missing from .env!")
+        return
+
+    async def post_init(app):
+        os.makedirs("data", exist_ok=True)
+        app.bot_data["chat_log_task"] = asyncio.create_task(CHAT_LOG.run())
+
+    async def post_shutdown(app):
+        # Cancelling writes the batch in hand; flush whatever is still queued
+        task = app.bot_data.pop("chat_log_task", None)
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await CHAT_LOG.flush()
+        await llm.aclose()
+        if on_shutdown:
+            await on_shutdown()
+
+    # Updates from different chats run concurrently; the per-chat lock in handle_message keeps each chat ordered
+    app = (
+        ApplicationBuilder()
+        .token(token)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CallbackQueryHandler(button_handler))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler(answer_query)))
+
+    try:
+        logger.info("⚙️ Bot is polling for updates...")
+        # Only the update types the handlers use are requested from Telegram
+        app.run_polling(drop_pending_updates=True, allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY])
+    except KeyboardInterrupt:
+        logger.warning("停止: Bot manually interrupted.")
+    except Exception as e:
+        logger.error("💥 Fatal Bot Error: %s", e)
+    finally:
+        logger.info("💤 Bot shutdown complete.")
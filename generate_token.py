@@ -1,6 +1,9 @@
 import os
+import time
+import asyncio
 import logging
-import requests
+import httpx
+import orjson
 from dotenv import load_dotenv
 
 logger = logging.getLogger("TrafficDataFetcher")
@@ -11,12 +14,33 @@ load_dotenv()
 MAPPLS_CLIENT_ID = os.getenv("MAPPLS_CLIENT_ID")
 MAPPLS_CLIENT_SECRET = os.getenv("MAPPLS_CLIENT_SECRET")
 
+# Mappls tokens live ~24h; reuse until shortly before expiry
+TOKEN_EXPIRY_MARGIN_SEC = 60
+DEFAULT_TOKEN_TTL_SEC = 23 * 3600
+_token_cache = (None, 0.0)  # (token, expiry_epoch)
+
+ROUTE_PARAMS = {
+    "traffic": "true",
+    "steps": "false",
+    "resource": "route_eta"
+}
+
 
 # =====================================================
 # ⭐ STEP 1 — Get OAuth Token
 # =====================================================
 
-def get_mappls_token():
+def invalidate_mappls_token():
+    global _token_cache
+    _token_cache = (None, 0.0)
+
+
+async def get_mappls_token(http: httpx.AsyncClient):
+    global _token_cache
+    token, expiry = _token_cache
+    if token and time.time() < expiry - TOKEN_EXPIRY_MARGIN_SEC:
+        return token
+
     logger.info("🔐 Requesting Mappls OAuth token...")
     url = "https://outpost.mappls.com/api/security/oauth/token"
 
@@ -31,7 +55,7 @@ def get_mappls_token():
     }
 
     try:
-        response = requests.post(
+        response = await http.post(
             url,
             data=payload,
             headers=headers,
@@ -40,13 +64,15 @@ def get_mappls_token():
 
         logger.debug(f"Token Request Status: {response.status_code}")
 
-        data = response.json()
+        data = orjson.loads(response.content)
 
         if "access_token" not in data:
             logger.error(f"❌ Failed to get token. Response: {data}")
             return None
 
         token = data["access_token"]
+        expires_in = float(data.get("expires_in", DEFAULT_TOKEN_TTL_SEC))
+        _token_cache = (token, time.time() + expires_in)
         logger.info("✅ Access Token obtained successfully.")
         return token
 
@@ -59,30 +85,33 @@ def get_mappls_token():
 # ⭐ STEP 2 — Fetch Traffic Data
 # =====================================================
 
-def fetch_mappls_traffic(lat: float, lon: float):
+async def fetch_mappls_traffic(http: httpx.AsyncClient, lat: float, lon: float):
     logger.info(f"🚦 Fetching Mappls traffic for ({lat}, {lon})")
-    token = get_mappls_token()
-
-    if not token:
-        logger.warning("⚠️ Skipping traffic fetch due to missing token.")
-        return
 
     dest_lat = lat + 0.02
     dest_lon = lon + 0.02
 
-    url = f"https://apis.mappls.com/advancedmaps/v1/{token}/route_adv/driving/{lon},{lat};{dest_lon},{dest_lat}"
+    try:
+        # With a cached token this is a single HTTPS call; retry once with a fresh token on 401
+        for attempt in range(2):
+            token = await get_mappls_token(http)
 
-    params = {
-        "traffic": "true",
-        "steps": "false",
-        "resource": "route_eta"
-    }
+            if not token:
+                logger.warning("⚠️ Skipping traffic fetch due to missing token.")
+                return
 
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        logger.debug(f"Traffic API Status: {response.status_code}")
-        
-        data = response.json()
+            url = f"https://apis.mappls.com/advancedmaps/v1/{token}/route_adv/driving/{lon},{lat};{dest_lon},{dest_lat}"
+
+            response = await http.get(url, params=ROUTE_PARAMS, timeout=10)
+            logger.debug(f"Traffic API Status: {response.status_code}")
+
+            if response.status_code == 401 and attempt == 0:
+                logger.warning("🔁 Mappls token rejected, refreshing...")
+                invalidate_mappls_token()
+                continue
+            break
+
+        data = orjson.loads(response.content)
 
         if response.status_code != 200:
             logger.error(f"❌ Traffic API Error: {data}")
@@ -97,11 +126,11 @@ def fetch_mappls_traffic(lat: float, lon: float):
         route = routes[0]
 
         distance_km = route.get("distance", 0) / 1000
-        duration_min = route.get("duration", 0) / 60
-        duration_no_traffic = route.get("duration_without_traffic", route.get("duration", 0)) / 60
-        delay_min = max(0, duration_min - duration_no_traffic)
+        duration_sec = route.get("duration", 0)
+        duration_min = duration_sec / 60
+        delay_min = max(0, duration_sec - route.get("duration_without_traffic", duration_sec)) / 60
 
-        avg_speed = distance_km / (duration_min / 60) if duration_min else 0
+        avg_speed = distance_km * 3600 / duration_sec if duration_sec else 0
 
         if delay_min > 10:
             congestion = "CRITICAL"
@@ -142,4 +171,8 @@ if __name__ == "__main__":
     latitude = 18.5308
     longitude = 73.8470
 
-    fetch_mappls_traffic(latitude, longitude)
\ No newline at end of file
+    async def run():
+        async with httpx.AsyncClient() as http:
+            await fetch_mappls_traffic(http, latitude, longitude)
+
+    asyncio.run(run())
@@ -1,28 +1,44 @@
+import io
 import os
-import re
-import json
+import csv
+import queue
+import asyncio
 import logging
-import requests
-from bs4 import BeautifulSoup
-from datetime import datetime
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse, JSONResponse
-from pydantic import BaseModel
+import httpx
+import orjson
+import numpy as np
+from selectolax.lexbor import LexborHTMLParser
+from cachetools import TTLCache
+from cachetools.keys import hashkey
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from hashlib import blake2b
+from datetime import date
+from functools import lru_cache
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict
 from dotenv import load_dotenv
-from openai import OpenAI
-from generate_token import fetch_mappls_traffic
+from openai import AsyncOpenAI
+from generate_token import fetch_mappls_traffic, get_mappls_token
+from storage import INPUT_LOG_PATH, OUTPUT_LOG_PATH, append_jsonl_async, read_jsonl, read_last_jsonl
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
 load_dotenv()
 
 # --- LOGGING CONFIGURATION ---
+# Log calls only enqueue; a listener thread does the console/file writes off the request path
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(
+    log_queue,
+    logging.StreamHandler(),
+    logging.FileHandler("data/app_debug.log", encoding="utf-8"),
+)
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("data/app_debug.log", encoding="utf-8")
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
 logger = logging.getLogger("SmartVenueTrafficAI")
 
@@ -30,7 +46,7 @@ logger = logging.getLogger("SmartVenueTrafficAI")
 os.makedirs("data", exist_ok=True)
 logger.info("Initializing Smart Venue Traffic Intelligence API...")
 
-client = OpenAI(
+async_client = AsyncOpenAI(
     base_url="https://openrouter.ai/api/v1",
     api_key=os.getenv("OPENROUTER_API_KEY"),
 )
@@ -38,7 +54,52 @@ client = OpenAI(
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY") 
 OVERPASS_URL = "https://overpass-api.de/api/interpreter"
 
-app = FastAPI(title="Smart Venue Traffic Intelligence API")
+# --- RESPONSE CACHES ---
+# Only touched from the event loop (no await between lookup and store), so no lock is needed
+geocode_cache = TTLCache(maxsize=1024, ttl=30 * 24 * 3600)
+metro_cache = TTLCache(maxsize=1024, ttl=7 * 24 * 3600)
+weather_cache = TTLCache(maxsize=1024, ttl=600)
+live_data_cache = TTLCache(maxsize=512, ttl=900)
+# LLM results keyed by a hash of the prompt inputs; per-key locks single-flight identical calls
+llm_cache = TTLCache(maxsize=2048, ttl=1800)
+llm_locks: dict[str, asyncio.Lock] = {}
+
+def venue_key(venue_name: str) -> str:
+    return " ".join(venue_name.lower().split())
+
+def coord_key(lat: float, lon: float):
+    # ~100m buckets so nearby requests share an entry
+    return hashkey(round(lat, 3), round(lon, 3))
+
+REQUIRED_ENV_VARS = ("MAPPLS_CLIENT_ID", "MAPPLS_CLIENT_SECRET", "OPENWEATHER_API_KEY")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener.start()
+    # Fail fast instead of erroring deep inside every request
+    missing = [name for name in REQUIRED_ENV_VARS if not os.getenv(name)]
+    if missing:
+        logger.critical(f"Missing required environment variables: {', '.join(missing)}")
+        log_listener.stop()  # flush the queue before aborting startup
+        raise RuntimeError(f"Missing required environment variables: {', '.join(missing)}")
+    # Shared async client reuses TCP/TLS connections across all outbound calls
+    # HTTP/2 lets concurrent requests to the same host share one multiplexed connection
+    app.state.http = httpx.AsyncClient(
+        headers={"User-Agent": "SmartVenueTrafficAI/1.0", "Accept-Encoding": "gzip, deflate, br"},
+        timeout=15,
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        ),
+    )
+    # Warm the token cache so the first request skips the OAuth round-trip
+    await get_mappls_token(app.state.http)
+    yield
+    await app.state.http.aclose()
+    log_listener.stop()
+
+app = FastAPI(title="Smart Venue Traffic Intelligence API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # --- CORS CONFIGURATION ---
 app.add_middleware(
@@ -48,6 +109,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# History endpoints return whole logs; JSON compresses well
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # --- DECISION SYSTEM CONSTANTS ---
 SYSTEM_PROMPT_DECISION = """
@@ -96,161 +159,336 @@ Return JSON in EXACT format:
 }
 """
 
+# Static instructions + schema in one system message: fewer per-call tokens and a stable, cacheable prefix
+DECISION_SYSTEM_MESSAGE = SYSTEM_PROMPT_DECISION + OUTPUT_SCHEMA_DECISION
+# JSON mode makes the provider return a bare object, so no extraction step is needed
+DECISION_COMPLETION_ARGS = {
+    "model": "google/gemini-2.0-flash-001",
+    "temperature": 0.2,
+    "max_tokens": 700,
+    "response_format": {"type": "json_object"},
+}
+
 class VenueRequest(BaseModel):
     venue: str
 
+# --- AI OUTPUT SCHEMA ---
+# Lenient models: every field optional and extra keys kept, so validation never drops model output
+Scalar = str | int | float | None
+
+class LenientModel(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+class VenueInfo(LenientModel):
+    name: Scalar = None
+    type: Scalar = None
+    capacity: Scalar = None
+
+class EventContext(LenientModel):
+    likely_event_today: Scalar = None
+    date: Scalar = None
+    estimated_attendance: Scalar = None
+
+class PeakPeriod(LenientModel):
+    start: Scalar = None
+    end: Scalar = None
+    label: Scalar = None
+    description: Scalar = None
+
+class TrafficPrediction(LenientModel):
+    severity: Scalar = None
+    congestion_index: Scalar = None
+    confidence: Scalar = None
+    peak_period: PeakPeriod | None = None
+
+class ImpactZone(LenientModel):
+    radius: Scalar = None
+    level: Scalar = None
+    roads_affected: Scalar | list = None
+
+class TrafficResult(LenientModel):
+    venue: VenueInfo | None = None
+    event_context: EventContext | None = None
+    traffic_prediction: TrafficPrediction | None = None
+    impact_zones: list[ImpactZone] | ImpactZone | None = None
+
+@lru_cache(maxsize=1)
+def format_day(day: date) -> str:
+    return day.strftime("%d %B %Y")
+
 def get_today_date():
-    return datetime.now().strftime("%d %B %Y")
+    # Formatted once per calendar day
+    return format_day(date.today())
 
-def fetch_live_data(venue_name: str) -> str:
+async def fetch_live_data(http: httpx.AsyncClient, venue_name: str) -> str:
+    key = hashkey(venue_key(venue_name))
+    cached = live_data_cache.get(key)
+    if cached: return cached
     try:
         search_query = f"{venue_name} Pune fest hackathon event schedule 2026"
-        url = f"https://html.duckduckgo.com/html/?q={requests.utils.quote(search_query)}"
         headers = {"User-Agent": "Mozilla/5.0"}
-        response = requests.get(url, headers=headers, timeout=15)
-        soup = BeautifulSoup(response.text, "html.parser")
+        response = await http.get("https://html.duckduckgo.com/html/", params={"q": search_query}, headers=headers, timeout=15)
+        tree = LexborHTMLParser(response.text)
         results = ""
-        for i, el in enumerate(soup.select(".result")):
-            if i >= 8: break
-            title = el.select_one(".result__title")
-            snippet = el.select_one(".result__snippet")
-            title_text = title.get_text(strip=True) if title else ""
-            snippet_text = snippet.get_text(strip=True) if snippet else ""
+        for el in tree.css(".result")[:8]:
+            title = el.css_first(".result__title")
+            snippet = el.css_first(".result__snippet")
+            title_text = title.text(strip=True) if title else ""
+            snippet_text = snippet.text(strip=True) if snippet else ""
             if title_text or snippet_text:
                 results += f"Title: {title_text}\nSnippet: {snippet_text}\n---\n"
-        return results if results else "No reliable live data found."
+        results = results if results else "No reliable live data found."
+        live_data_cache[key] = results
+        return results
     except Exception as e:
         return f"Live search unavailable: {str(e)}"
 
-def geocode_venue(venue_name: str) -> tuple[float, float] | None:
+async def geocode_venue(http: httpx.AsyncClient, venue_name: str) -> tuple[float, float] | None:
+    key = hashkey(venue_key(venue_name))
+    cached = geocode_cache.get(key)
+    if cached: return cached
     try:
         search = f"{venue_name}, India"
-        response = requests.get("https://nominatim.openstreetmap.org/search",
-            params={"q": search, "format": "json", "limit": 1},
-            headers={"User-Agent": "SmartVenueTrafficAI/1.0"}, timeout=10)
-        data = response.json()
-        if data: return float(data[0]["lat"]), float(data[0]["lon"])
-        return None
+        response = await http.get("https://nominatim.openstreetmap.org/search",
+            params={"q": search, "format": "json", "limit": 1}, timeout=10)
+        data = orjson.loads(response.content)
+        if not data: return None
+        coords = float(data[0]["lat"]), float(data[0]["lon"])
+        geocode_cache[key] = coords
+        return coords
     except Exception: return None
 
-def fetch_nearest_metro(lat: float, lon: float) -> dict:
+def nearest_km(lat: float, lon: float, coords: np.ndarray) -> tuple[int, float]:
+    # Haversine term for every (lat, lon) row in one vectorized pass; it is monotonic in distance,
+    # so the argmin needs no trig beyond it and only the winner is converted to km
+    lats, lons = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    lat0, lon0 = np.radians(lat), np.radians(lon)
+    a = np.sin((lats - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lats) * np.sin((lons - lon0) / 2) ** 2
+    idx = int(np.argmin(a))
+    return idx, float(6371 * 2 * np.arcsin(np.sqrt(min(a[idx], 1.0))))
+
+async def fetch_nearest_metro(http: httpx.AsyncClient, lat: float, lon: float) -> dict:
+    key = coord_key(lat, lon)
+    cached = metro_cache.get(key)
+    if cached: return cached
     try:
-        overpass_query = f'[out:json][timeout:25];(node["railway"="station"]["station"="subway"](around:5000,{lat},{lon});node["railway"="subway_entrance"](around:5000,{lat},{lon});node["station"="subway"](around:5000,{lat},{lon}););out body;'
-        response = requests.post(OVERPASS_URL, data={"data": overpass_query}, timeout=25)
-        data = response.json()
-        elements = data.get("elements", [])
-        if not elements: return {"station_name": "None", "distance_km": None}
-        def haversine(lat1, lon1, lat2, lon2):
-            from math import radians, sin, cos, sqrt, atan2
-            R = 6371
-            dlat = radians(lat2 - lat1)
-            dlon = radians(lon2 - lon1)
-            a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-            return R * 2 * atan2(sqrt(a), sqrt(1 - a))
-        nearest = min(elements, key=lambda e: haversine(lat, lon, e["lat"], e["lon"]))
-        distance = haversine(lat, lon, nearest["lat"], nearest["lon"])
-        return {"station_name": nearest.get("tags", {}).get("name", "Unknown"), "distance_km": round(distance, 2)}
+        # station=subway already covers railway=station+station=subway; cap at 50 quadtile-sorted candidates
+        # CSV with just name/lat/lon instead of full JSON elements: a fraction of the bytes to transfer and parse
+        overpass_query = f'[out:csv(name,::lat,::lon;false)][timeout:25];(node["station"="subway"](around:5000,{lat},{lon});node["railway"="subway_entrance"](around:5000,{lat},{lon}););out qt 50;'
+        response = await http.post(OVERPASS_URL, data={"data": overpass_query}, timeout=25)
+        rows = [row for row in csv.reader(io.StringIO(response.text), delimiter="\t") if len(row) == 3]
+        if not rows:
+            result = {"station_name": "None", "distance_km": None}
+            metro_cache[key] = result
+            return result
+        # Single pass over the rows into an (N, 2) array
+        coords = np.array([(row[1], row[2]) for row in rows], dtype=np.float64)
+        idx, distance = nearest_km(lat, lon, coords)
+        result = {"station_name": rows[idx][0] or "Unknown", "distance_km": round(distance, 2)}
+        metro_cache[key] = result
+        return result
     except Exception: return {"station_name": "Error", "distance_km": None}
 
-def fetch_weather(lat: float, lon: float) -> dict:
+async def fetch_weather(http: httpx.AsyncClient, lat: float, lon: float) -> dict:
+    key = coord_key(lat, lon)
+    cached = weather_cache.get(key)
+    if cached: return cached
     try:
         if not OPENWEATHER_API_KEY: return {"error": "No key"}
-        
-        response = requests.get("https://api.openweathermap.org/data/2.5/weather",
+
+        response = await http.get("https://api.openweathermap.org/data/2.5/weather",
             params={"lat": lat, "lon": lon, "appid": OPENWEATHER_API_KEY, "units": "metric"}, timeout=10)
-        data = response.json()
+        data = orjson.loads(response.content)
         if data.get("cod") != 200: return {"error": "API error"}
         weather = data["weather"][0]
-        return {"condition": weather["description"].title(), "temperature_c": data["main"]["temp"]}
+        result = {"condition": weather["description"].title(), "temperature_c": data["main"]["temp"]}
+        weather_cache[key] = result
+        return result
     except Exception as e: return {"error": str(e)}
 
-def analyze_venue(venue_name: str, live_data: str) -> dict:
+async def read_json_object(stream) -> str:
+    # Scan streamed deltas and stop as soon as the first top-level JSON object closes
+    buffer = []
+    depth, in_string, escaped = 0, False, False
+    try:
+        async for chunk in stream:
+            if not chunk.choices: continue
+            for ch in chunk.choices[0].delta.content or "":
+                if not buffer and ch != "{": continue
+                buffer.append(ch)
+                if in_string:
+                    if escaped: escaped = False
+                    elif ch == "\\": escaped = True
+                    elif ch == '"': in_string = False
+                elif ch == '"': in_string = True
+                elif ch == "{": depth += 1
+                elif ch == "}":
+                    depth -= 1
+                    if depth == 0: return "".join(buffer)
+    finally:
+        await stream.close()
+    return "".join(buffer)
+
+async def analyze_venue(venue_name: str, live_data: str) -> dict:
+    key = blake2b(f"{venue_name}\0{live_data}".encode(), digest_size=16).hexdigest()
+    lock = llm_locks.setdefault(key, asyncio.Lock())
+    try:
+        async with lock:
+            cached = llm_cache.get(key)
+            if cached: return cached
+            result = await request_venue_analysis(venue_name, live_data)
+            llm_cache[key] = result
+            return result
+    finally:
+        if not lock.locked(): llm_locks.pop(key, None)
+
+async def request_venue_analysis(venue_name: str, live_data: str) -> dict:
     try:
         system_prompt = f"You are a Pune Smart City Traffic AI. Return ONLY JSON. Search {live_data}. Output keys: venue(name, type, capacity), event_context(likely_event_today, date, estimated_attendance), traffic_prediction(severity, congestion_index, confidence, peak_period(start, end, label, description)), impact_zones(radius, level, roads_affected)."
-        response = client.chat.completions.create(
+        stream = await async_client.chat.completions.create(
             model="google/gemini-2.0-flash-001",
             temperature=0.25,
+            max_tokens=400,
+            response_format={"type": "json_object"},
+            stream=True,
             messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": f"VENUE: {venue_name}\nLIVE DATA: {live_data}"}]
         )
-        content = response.choices[0].message.content.strip()
-        match = re.search(r"\{[\s\S]*\}", content)
-        return json.loads(match.group(0))
+        content = await read_json_object(stream)
+        return TrafficResult.model_validate_json(content).model_dump(exclude_unset=True)
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
+async def predict_traffic(http: httpx.AsyncClient, venue_name: str) -> dict:
+    live_data = await fetch_live_data(http, venue_name)
+    return await analyze_venue(venue_name, live_data)
+
+async def _persist(result: dict):
+    try: await append_jsonl_async(INPUT_LOG_PATH, result)
+    except Exception: pass
+
+async def run_analysis(http: httpx.AsyncClient, venue_name: str) -> dict:
+    # The live-search + AI chain only needs the venue name, so start it before geocoding
+    traffic_task = asyncio.create_task(predict_traffic(http, venue_name))
+    coords = await geocode_venue(http, venue_name)
+    if not coords:
+        traffic_task.cancel()
+        raise HTTPException(status_code=404, detail="Geocoding failed")
+    lat, lon = coords
+    traffic_result, metro_result, weather_result, mappls_traffic = await asyncio.gather(
+        traffic_task,
+        fetch_nearest_metro(http, lat, lon),
+        fetch_weather(http, lat, lon),
+        fetch_mappls_traffic(http, lat, lon),
+    )
+    return {**traffic_result, "location": {"latitude": lat, "longitude": lon}, "nearest_metro_station": metro_result, "weather": weather_result, "mappls_live_traffic": mappls_traffic}
+
+# Single-flight: concurrent identical requests share one upstream run
+in_flight: dict[str, asyncio.Task] = {}
+
+def join_in_flight(key: str, start) -> tuple[asyncio.Task, bool]:
+    task = in_flight.get(key)
+    if task: return task, False
+    task = asyncio.create_task(start())
+    in_flight[key] = task
+    task.add_done_callback(lambda _: in_flight.pop(key, None))
+    return task, True
+
 @app.post("/analyze")
-def analyze(request: VenueRequest):
+async def analyze(request: VenueRequest, background: BackgroundTasks):
     venue_name = request.venue.strip()
-    coords = geocode_venue(venue_name)
-    if not coords: raise HTTPException(status_code=404, detail="Geocoding failed")
-    lat, lon = coords
-    live_data = fetch_live_data(venue_name)
-    traffic_result = analyze_venue(venue_name, live_data)
-    metro_result = fetch_nearest_metro(lat, lon)
-    weather_result = fetch_weather(lat, lon)
-    mappls_traffic = fetch_mappls_traffic(lat, lon)
-    result = {**traffic_result, "location": {"latitude": lat, "longitude": lon}, "nearest_metro_station": metro_result, "weather": weather_result, "mappls_live_traffic": mappls_traffic}
-    try:
-        if os.path.exists("data/input.json"):
-            with open("data/input.json", "r") as f: inputs = json.load(f)
-        else: inputs = []
-        inputs.append(result)
-        with open("data/input.json", "w") as f: json.dump(inputs, f, indent=4)
-    except Exception: pass
+    task, is_leader = join_in_flight(f"analyze:{venue_key(venue_name)}", lambda: run_analysis(app.state.http, venue_name))
+    # Shielded so one client disconnecting doesn't cancel the run for the others
+    result = await asyncio.shield(task)
+    # Written after the response is sent
+    if is_leader: background.add_task(_persist, result)
     return result
 
-@app.post("/output")
-def generate_output_decision():
-    input_path = "data/input.json"
-    output_path = "data/output.json"
-    if not os.path.exists(input_path): raise HTTPException(status_code=404, detail="No input")
-    with open(input_path, "r") as f: input_data = json.load(f)[-1]
-    response = client.chat.completions.create(
-        model="google/gemini-2.0-flash-001",
-        temperature=0.2,
-        messages=[{"role": "system", "content": SYSTEM_PROMPT_DECISION}, {"role": "user", "content": f"INPUT:\n{json.dumps(input_data)}\n\nSCHEMA:\n{OUTPUT_SCHEMA_DECISION}"}]
-    )
-    decision = json.loads(re.search(r"\{[\s\S]*\}", response.choices[0].message.content).group(0))
-    if os.path.exists(output_path):
-        with open(output_path, "r") as f: outputs = json.load(f)
-    else: outputs = []
-    outputs.append(decision)
-    with open(output_path, "w") as f: json.dump(outputs, f, indent=4)
+async def stream_decision(messages: list):
+    # Server-sent events: one event per delta, then the parsed decision once it is persisted
+    stream = await async_client.chat.completions.create(**DECISION_COMPLETION_ARGS, stream=True, messages=messages)
+    parts = []
+    async for chunk in stream:
+        if not chunk.choices: continue
+        delta = chunk.choices[0].delta.content
+        if not delta: continue
+        parts.append(delta)
+        yield b"data: " + orjson.dumps({"delta": delta}) + b"\n\n"
+    try:
+        decision = orjson.loads("".join(parts))
+        await append_jsonl_async(OUTPUT_LOG_PATH, decision)
+        yield b"event: decision\ndata: " + orjson.dumps(decision) + b"\n\n"
+    except Exception as e:
+        yield b"event: error\ndata: " + orjson.dumps({"detail": str(e)}) + b"\n\n"
+
+async def request_decision(messages: list) -> dict:
+    response = await async_client.chat.completions.create(**DECISION_COMPLETION_ARGS, messages=messages)
+    decision = orjson.loads(response.choices[0].message.content)
+    await append_jsonl_async(OUTPUT_LOG_PATH, decision)
     return decision
 
+@app.post("/output")
+async def generate_output_decision(stream: bool = False):
+    input_data = await asyncio.to_thread(read_last_jsonl, INPUT_LOG_PATH)
+    if not input_data: raise HTTPException(status_code=404, detail="No input")
+    messages = [{"role": "system", "content": DECISION_SYSTEM_MESSAGE}, {"role": "user", "content": f"INPUT:\n{orjson.dumps(input_data).decode()}"}]
+    if stream:
+        # Explicit identity encoding keeps GZipMiddleware from buffering the event stream
+        return StreamingResponse(stream_decision(messages), media_type="text/event-stream", headers={"Content-Encoding": "identity"})
+    # Callers that arrive while a decision for the same input is pending share it (persisted once)
+    key = "output:" + blake2b(messages[1]["content"].encode(), digest_size=16).hexdigest()
+    task, _ = join_in_flight(key, lambda: request_decision(messages))
+    return await asyncio.shield(task)
+
+# --- HISTORY ENDPOINTS ---
+# The logs are append-only, so mtime + size identify a version; unchanged history answers 304
+def log_etag(*paths: str) -> str:
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f"{st.st_mtime_ns:x}-{st.st_size:x}")
+        except FileNotFoundError:
+            parts.append("0")
+    return '"' + ".".join(parts) + '"'
+
+async def history_response(request: Request, paths: tuple, load):
+    etag = log_etag(*paths)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return ORJSONResponse(await load(), headers={"ETag": etag})
+
 @app.get("/inputs")
-def get_inputs():
-    if os.path.exists("data/input.json"):
-        with open("data/input.json", "r") as f: return json.load(f)
-    return []
+async def get_inputs(request: Request):
+    return await history_response(request, (INPUT_LOG_PATH,), lambda: asyncio.to_thread(read_jsonl, INPUT_LOG_PATH))
 
 @app.get("/outputs")
-def get_outputs():
-    if os.path.exists("data/output.json"):
-        with open("data/output.json", "r") as f: return json.load(f)
-    return []
+async def get_outputs(request: Request):
+    return await history_response(request, (OUTPUT_LOG_PATH,), lambda: asyncio.to_thread(read_jsonl, OUTPUT_LOG_PATH))
 
-@app.get("/data")
-def get_all_data():
-    inputs = []
-    outputs = []
-    if os.path.exists("data/input.json"):
-        with open("data/input.json", "r") as f:
-            inputs = json.load(f)
-    if os.path.exists("data/output.json"):
-        with open("data/output.json", "r") as f:
-            outputs = json.load(f)
+async def load_all_data() -> dict:
+    inputs, outputs = await asyncio.gather(
+        asyncio.to_thread(read_jsonl, INPUT_LOG_PATH),
+        asyncio.to_thread(read_jsonl, OUTPUT_LOG_PATH),
+    )
     return {"inputs": inputs, "outputs": outputs}
 
+@app.get("/data")
+async def get_all_data(request: Request):
+    return await history_response(request, (INPUT_LOG_PATH, OUTPUT_LOG_PATH), load_all_data)
+
 @app.get("/map")
 def get_map():
     return FileResponse("index.html")
 
 @app.get("/output.json")
-def get_output_json():
-    if os.path.exists("data/output.json"):
-        return FileResponse("data/output.json")
+async def get_output_json(request: Request):
+    if os.path.exists(OUTPUT_LOG_PATH):
+        return await history_response(request, (OUTPUT_LOG_PATH,), lambda: asyncio.to_thread(read_jsonl, OUTPUT_LOG_PATH))
     return {"error": "not found"}
 
 @app.get("/")
 def root():
     return {"status": "ok", "map_dashboard": "/map"}
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=os.cpu_count(), loop="uvloop", http="httptools")
@@ -1,7 +1,8 @@
-import json
 import os
+import orjson
 from openai import OpenAI
 from dotenv import load_dotenv
+from storage import INPUT_LOG_PATH, OUTPUT_LOG_PATH, append_jsonl, read_last_jsonl
 
 load_dotenv()
 
@@ -10,8 +11,8 @@ client = OpenAI(
     api_key=os.getenv("OPENAI_API_KEY"),
 )
 
-INPUT_PATH = "data/input.json"
-OUTPUT_PATH = "data/output.json"
+INPUT_PATH = INPUT_LOG_PATH
+OUTPUT_PATH = OUTPUT_LOG_PATH
 
 SYSTEM_PROMPT = """
 You are a Government-grade AI Traffic Control System for Pune, India.
@@ -66,56 +67,32 @@ Return JSON in EXACT format:
 }
 """
 
+# Schema rides in the system prompt so only the compact input changes between runs
+SYSTEM_MESSAGE = SYSTEM_PROMPT + OUTPUT_SCHEMA
+
 def load_input():
-    with open(INPUT_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        if isinstance(data, list):
-            return data[-1] # Process the latest input
-        return data
+    return read_last_jsonl(INPUT_PATH) # Process the latest input
 
 def generate_decision(data):
 
     response = client.chat.completions.create(
         model="google/gemini-2.5-flash",
         temperature=0.2,
-        max_tokens=900,
+        max_tokens=700,
+        response_format={"type": "json_object"},
         messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "system", "content": SYSTEM_MESSAGE},
             {
                 "role": "user",
-                "content": f"""
-INPUT TRAFFIC STATE:
-{json.dumps(data, indent=2)}
-
-{OUTPUT_SCHEMA}
-"""
+                "content": f"INPUT TRAFFIC STATE:\n{orjson.dumps(data).decode()}"
             }
         ],
     )
 
-    content = response.choices[0].message.content.strip()
-
-    start = content.find("{")
-    end = content.rfind("}") + 1
-    json_text = content[start:end]
-
-    return json.loads(json_text)
+    return orjson.loads(response.choices[0].message.content)
 
 def save_output(output):
-    outputs = []
-    if os.path.exists(OUTPUT_PATH):
-        try:
-            with open(OUTPUT_PATH, "r", encoding="utf-8") as f:
-                outputs = json.load(f)
-                if not isinstance(outputs, list):
-                    outputs = [outputs] if outputs else []
-        except Exception:
-            outputs = []
-    
-    outputs.append(output)
-    
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(outputs, f, indent=4)
+    append_jsonl(OUTPUT_PATH, output)
 
 if __name__ == "__main__":
 
@@ -128,4 +105,4 @@ if __name__ == "__main__":
     save_output(decision)
 
     print("✅ Output saved to:", OUTPUT_PATH)
-    print(json.dumps(decision, indent=4))
\ No newline at end of file
+    print(orjson.dumps(decision, option=orjson.OPT_INDENT_2).decode())
\ No newline at end of file
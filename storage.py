@@ -0,0 +1,130 @@
+import os
+import asyncio
+import aiofiles
+import orjson
+
+# Append-only JSON Lines logs: one record per line, O(1) per write
+INPUT_LOG_PATH = "data/input.jsonl"
+OUTPUT_LOG_PATH = "data/output.jsonl"
+
+TAIL_BLOCK_SIZE = 4096
+
+
+def append_jsonl(path: str, record: dict):
+    with open(path, "ab") as f:
+        f.write(orjson.dumps(record) + b"\n")
+
+
+async def append_jsonl_async(path: str, record: dict):
+    async with aiofiles.open(path, "ab") as f:
+        await f.write(orjson.dumps(record) + b"\n")
+
+
+def read_jsonl(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        return [orjson.loads(line) for line in f if line.strip()]
+
+
+# Parsed logs keyed by path; reused until the file's mtime or size changes
+_jsonl_cache: dict[str, tuple] = {}
+
+
+def log_version(path: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def read_jsonl_cached(path: str) -> list:
+    # Callers share the returned list, so treat it as read-only
+    version = log_version(path)
+    if version is None:
+        return []
+    cached = _jsonl_cache.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    records = read_jsonl(path)
+    _jsonl_cache[path] = (version, records)
+    return records
+
+
+def read_last_jsonl(path: str) -> dict | None:
+    # Seek backwards from the end until a full last line is buffered
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        while pos > 0:
+            step = min(TAIL_BLOCK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+            line_start = tail.rstrip().rfind(b"\n")
+            if line_start != -1:
+                return orjson.loads(tail[line_start + 1:])
+    tail = tail.strip()
+    return orjson.loads(tail) if tail else None
+
+
+# Last record per path, refreshed only when the file's mtime or size changes
+_last_jsonl_cache: dict[str, tuple] = {}
+
+
+def read_last_jsonl_cached(path: str) -> dict | None:
+    version = log_version(path)
+    if version is None:
+        return None
+    cached = _last_jsonl_cache.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    record = read_last_jsonl(path)
+    _last_jsonl_cache[path] = (version, record)
+    return record
+
+
+class JsonlBatchWriter:
+    # Queues records and appends each batch with one open/write instead of one per record
+    def __init__(self, path: str, max_batch: int = 32, flush_interval: float = 3.0):
+        self.path = path
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def put(self, record: dict):
+        self.queue.put_nowait(record)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                deadline = loop.time() + self.flush_interval
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), deadline - loop.time()))
+                    except TimeoutError:
+                        break
+                await self._write(batch)
+                batch = []
+        except asyncio.CancelledError:
+            await self._write(batch)
+            raise
+
+    async def flush(self):
+        batch = []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        await self._write(batch)
+
+    async def _write(self, batch: list):
+        if not batch:
+            return
+        async with aiofiles.open(self.path, "ab") as f:
+            await f.write(b"".join(orjson.dumps(record) + b"\n" for record in batch))